@@ -22,6 +22,7 @@ from .keepassxc_db import (
     KeepassxcDatabase,
     KeepassxcCliNotFoundError,
     KeepassxcFileNotFoundError,
+    KeepassxcLockedDbError,
     KeepassxcCliError,
 )
 from .gtk_passphrase_entry import GtkPassphraseEntryWindow
@@ -181,6 +182,11 @@ class KeywordQueryEventListener(EventListener):
                     extension.get_key_file_path()
                 )
             return self.process_keyword_query(event, extension)
+        except KeepassxcLockedDbError:
+            # Inactivity lock kicked in after the check above
+            return render.ask_to_enter_passphrase(
+                extension.get_db_path(), extension.get_key_file_path()
+            )
         except KeepassxcCliNotFoundError:
             return render.cli_not_found_error()
         except KeepassxcFileNotFoundError:
@@ -6,10 +6,23 @@ Features:
     - Search entries
     - Retrieve entry details (username, password, notes, URL)
 """
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Optional
+from collections import OrderedDict
+from concurrent.futures import Future
+import shutil
 import subprocess
 import os
-from datetime import datetime, timedelta
+import threading
+import time
+
+# How many distinct search queries to remember
+SEARCH_CACHE_SIZE = 128
+# Clock for the inactivity lock: unlike CLOCK_MONOTONIC, CLOCK_BOOTTIME
+# keeps counting while the computer is suspended
+LOCK_CLOCK = getattr(time, "CLOCK_BOOTTIME", time.CLOCK_MONOTONIC)
+# Entry attributes returned by get_entry_details,
+# multi-line Notes must be the last one (see parse_entry_details)
+ENTRY_ATTRS = ["UserName", "Password", "URL", "Notes"]
 
 
 class KeepassxcCliNotFoundError(Exception):
@@ -38,6 +51,40 @@ class KeepassxcCliError(Exception):
         self.message = message
 
 
+def parse_search_results(err: bytes, out: bytes, return_code: int) -> List[str]:
+    """
+    Turn the raw output of `keepassxc-cli search` into a list of entry names
+    """
+    if return_code != 0:
+        if b"No results for that" in err:
+            return []
+        raise KeepassxcCliError(err.decode("utf-8", "replace"))
+    # Entry names in keepassxc-cli start with a "/"
+    # (because kdbx files have a tree structure with "folders" etc)
+    # For aesthetic purposes, we are removing the leading "/" here
+    # but will add it back any time we need to pass an entry name
+    # to the CLI as an argument.
+    # Lines that don't start with a "/" aren't entry names (e.g. warnings).
+    # Only the lines we keep get decoded.
+    return [l[1:].decode("utf-8") for l in out.splitlines() if l.startswith(b"/")]
+
+
+def parse_entry_details(err: str, out: str, return_code: int) -> Dict[str, str]:
+    """
+    Turn the output of `keepassxc-cli show` with one -a option per
+    ENTRY_ATTRS into a dict of attributes and their values
+    """
+    if return_code != 0:
+        raise KeepassxcCliError(err)
+    # The CLI prints one value per line in the order they were requested,
+    # so everything after the first few lines belongs to Notes
+    if out.endswith("\n"):
+        out = out[:-1]
+    values = out.split("\n", len(ENTRY_ATTRS) - 1)
+    values += [""] * (len(ENTRY_ATTRS) - len(values))
+    return {attr: val.strip("\n") for attr, val in zip(ENTRY_ATTRS, values)}
+
+
 class KeepassxcDatabase:
     """ Wrapper around keepassxc-cli """
 
@@ -46,12 +93,34 @@ class KeepassxcDatabase:
         self.cli_checked = False
         self.path = None
         self.path_checked = False
+        # mtime of the database file when its path was checked
+        self.path_mtime_ns: Optional[int] = None
+        # key file path exactly as given to initialize() the last time
+        self.key_file_setting: Optional[str] = None
         self.key_file_path = None
-        self.passphrase = None
-        self.passphrase_expires_at = None
+        self.key_file_args: List[str] = []
+        # Encoded passphrase, a bytearray so that it can be wiped when locking
+        self.passphrase_bytes: Optional[bytearray] = None
+        # LOCK_CLOCK time after which the passphrase is forgotten
+        self.passphrase_expires_at: Optional[float] = None
+        # Locks the database as soon as the inactivity timeout runs out
+        self.lock_timer: Optional[threading.Timer] = None
+        # The lock timer locks the database from its own thread, this guards
+        # the passphrase and the search cache against that (and other threads)
+        self.state_lock = threading.RLock()
         self.inactivity_lock_timeout = 0
+        # Search results for the database file as of path_mtime_ns
+        self.search_cache: "OrderedDict[str, List[str]]" = OrderedDict()
+        # Searches that are running right now, keyed by query
+        self.inflight_searches: Dict[str, "Future[List[str]]"] = {}
+        self.inflight_searches_lock = threading.Lock()
 
-    def initialize(self, path: str, inactivity_lock_timeout: int, key_file_path: str = None) -> None:
+    def initialize(
+        self,
+        path: str,
+        inactivity_lock_timeout: int,
+        key_file_path: Optional[str] = None,
+    ) -> None:
         """
         Check that
         - we can call invoke the CLI
@@ -70,23 +139,32 @@ class KeepassxcDatabase:
         if path != self.path:
             self.path = path
             self.path_checked = False
-            self.passphrase = None
+            self.lock()
 
         if not self.path_checked:
-            if os.path.exists(self.path):
-                self.path_checked = True
-            else:
-                raise KeepassxcFileNotFoundError()
+            try:
+                self.path_mtime_ns = os.stat(self.path).st_mtime_ns
+            except OSError as exc:
+                raise KeepassxcFileNotFoundError() from exc
+            self.path_checked = True
 
-        # Set key file path if provided
-        if key_file_path:
-            expanded_key_file_path = os.path.expanduser(key_file_path)
-            if os.path.exists(expanded_key_file_path):
+        # Only check the key file when it's different from last time
+        key_file_path = key_file_path or None
+        if key_file_path != self.key_file_setting:
+            if key_file_path:
+                expanded_key_file_path = os.path.expanduser(key_file_path)
+                if not os.path.exists(expanded_key_file_path):
+                    raise KeepassxcFileNotFoundError(
+                        f"Key file not found: {expanded_key_file_path}"
+                    )
                 self.key_file_path = expanded_key_file_path
+                self.key_file_args = ["-k", expanded_key_file_path]
             else:
-                raise KeepassxcFileNotFoundError(f"Key file not found: {expanded_key_file_path}")
-        else:
-            self.key_file_path = None
+                self.key_file_path = None
+                self.key_file_args = []
+            self.key_file_setting = key_file_path
+            # The passphrase alone may not be enough anymore, or too much
+            self.lock()
 
     def change_path(self, new_path: str) -> None:
         """
@@ -94,60 +172,148 @@ class KeepassxcDatabase:
         """
         self.path = os.path.expanduser(new_path)
         self.path_checked = False
-        self.passphrase = None
-        self.passphrase_expires_at = None
+        self.path_mtime_ns = None
+        self.lock()
 
     def change_inactivity_lock_timeout(self, secs: int) -> None:
         """
         Change the inactivity lock timeout and immediately lock the database.
         """
         self.inactivity_lock_timeout = secs
-        self.passphrase = None
-        self.passphrase_expires_at = None
+        self.lock()
+
+    def lock(self) -> None:
+        """
+        Forget the passphrase and everything we've learned while it was known
+        """
+        with self.state_lock:
+            if self.lock_timer is not None:
+                self.lock_timer.cancel()
+                self.lock_timer = None
+            if self.passphrase_bytes is not None:
+                # Overwrite the passphrase instead of waiting for it to be collected
+                self.passphrase_bytes[:] = bytes(len(self.passphrase_bytes))
+            self.passphrase_bytes = None
+            self.passphrase_expires_at = None
+            self.search_cache.clear()
 
     def is_passphrase_needed(self):
         """
         Whether the user needs to enter the passphrase to unlock the database
         """
-        if self.passphrase is None:
-            return True
-        if self.inactivity_lock_timeout:
-            if datetime.now() > self.passphrase_expires_at:
-                self.passphrase = None
+        with self.state_lock:
+            if self.passphrase_bytes is None:
                 return True
-        return False
+            # Normally the lock timer has locked the database by now,
+            # but timers don't count the time the computer was suspended for
+            if self.inactivity_lock_timeout:
+                if time.clock_gettime(LOCK_CLOCK) > self.passphrase_expires_at:
+                    self.lock()
+                    return True
+            return False
 
     def verify_and_set_passphrase(self, passphrase: str) -> bool:
         """
         Try to query the database using the given passphrase,
         save the passphrase if successful
         """
-        self.passphrase = passphrase
-        err, out, return_code = self.run_cli("ls", "-q", self.path)
-        if return_code != 0:
-            self.passphrase = None
-            return False
+        with self.state_lock:
+            self.lock()
+            self.passphrase_bytes = bytearray(passphrase.encode("utf-8"))
+            err, out, return_code = self.run_cli("ls", "-q", self.path)
+            if return_code != 0:
+                self.lock()
+                return False
         return True
 
     def search(self, query: str) -> List[str]:
         """
-        Search the database for entry titles that contain the given query string
+        Search the database for entries that match the given query string,
+        matching is left to keepassxc-cli (titles, usernames, URLs, notes etc.)
+
+        Results are cached until the database file changes so that
+        repeating a query doesn't unlock the database again.
+        Searching for a query that is already being searched for
+        waits for that search to finish instead of starting another one.
+        """
+        with self.inflight_searches_lock:
+            future = self.inflight_searches.get(query)
+            is_waiting = future is not None
+            if future is None:
+                future = Future()
+                self.inflight_searches[query] = future
+        if is_waiting:
+            return future.result()
+
+        try:
+            entries = self.search_once(query)
+        except Exception as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(entries)
+        finally:
+            with self.inflight_searches_lock:
+                del self.inflight_searches[query]
+        return entries
+
+    def search_once(self, query: str) -> List[str]:
+        """
+        Do the actual work of `search`
         """
         if self.is_passphrase_needed():
             raise KeepassxcLockedDbError()
 
-        (err, out, return_code) = self.run_cli("search", "-q", self.path, query)
-        if return_code != 0:
-            if "No results for that" in err:
-                return []
-            raise KeepassxcCliError(err)
-        # Entry names in keepassxc-cli start with a "/"
-        # (because kdbx files have a tree structure with "folders" etc)
-        # For aesthetic purposes, we are removing the leading "/" here
-        # by blindly cutting off the first char
-        # but will add it back any time we need to pass an entry name
-        # to the CLI as an argument
-        return [l[1:] for l in out.splitlines()]
+        db_mtime_ns = self.check_db_changed()
+        entries = self.get_cached_search(query)
+        if entries is None:
+            entries = parse_search_results(
+                *self.run_cli_bytes("search", "-q", self.path, query)
+            )
+            self.cache_search(query, entries, db_mtime_ns)
+        return entries
+
+    def check_db_changed(self) -> int:
+        """
+        Forget cached search results if the database file has been modified
+        since they were cached. Returns mtime of the database file.
+        """
+        with self.state_lock:
+            try:
+                db_mtime_ns = os.stat(self.path).st_mtime_ns
+            except OSError as exc:
+                self.path_checked = False
+                raise KeepassxcFileNotFoundError() from exc
+            if db_mtime_ns != self.path_mtime_ns:
+                self.search_cache.clear()
+                self.path_mtime_ns = db_mtime_ns
+        return db_mtime_ns
+
+    def get_cached_search(self, query: str) -> Optional[List[str]]:
+        """
+        Results of an earlier search for the same query, if any
+        """
+        with self.state_lock:
+            entries = self.search_cache.get(query)
+            if entries is not None:
+                self.search_cache.move_to_end(query)
+            return entries
+
+    def cache_search(self, query: str, entries: List[str], db_mtime_ns: int) -> None:
+        """
+        Remember search results, forgetting the least recently used ones
+
+        `db_mtime_ns` is the mtime of the database file the search ran against.
+        The results are dropped if another search has seen the file change
+        in the meantime, so they can't end up cached for the newer file.
+        """
+        with self.state_lock:
+            if db_mtime_ns != self.path_mtime_ns:
+                return
+            self.search_cache[query] = entries
+            self.search_cache.move_to_end(query)
+            if len(self.search_cache) > SEARCH_CACHE_SIZE:
+                self.search_cache.popitem(last=False)
 
     def get_entry_details(self, entry: str) -> Dict[str, str]:
         """
@@ -162,59 +328,103 @@ class KeepassxcDatabase:
         """
         if self.is_passphrase_needed():
             raise KeepassxcLockedDbError()
+        # Ask for all the attributes in one go instead of calling the CLI
+        # once per attribute - every call has to unlock the database again
+        return parse_entry_details(*self.run_cli(*self.show_entry_args(entry)))
 
-        attrs = dict()
-        for attr in ["UserName", "Password", "URL", "Notes"]:
-            (err, out, return_code) = self.run_cli("show", "-q", "-a", attr, self.path, f"/{entry}")
-            if return_code != 0:
-                raise KeepassxcCliError(err)
-            attrs[attr] = out.strip("\n")
-        return attrs
+    def show_entry_args(self, entry: str) -> List[str]:
+        """
+        CLI args to retrieve all ENTRY_ATTRS of the given entry
+        """
+        args = ["show", "-q"]
+        for attr in ENTRY_ATTRS:
+            args.extend(["-a", attr])
+        return args + [self.path, f"/{entry}"]
 
     def can_execute_cli(self) -> bool:
         """
         Whether we are able to execute the KeePassXC without an OS error
+
+        Only looks the executable up on PATH instead of running it,
+        and remembers where it was found.
         """
         try:
-            subprocess.run(
-                [self.cli], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False
-            )
-            return True
+            cli_path = shutil.which(self.cli)
         except OSError:
             return False
+        if cli_path is None:
+            return False
+        self.cli = cli_path
+        return True
+
+    def cli_args(self, *args) -> List[str]:
+        """
+        Full command line to execute the KeePassXC CLI with given args
+        """
+        # Key file is an option of the command (e.g. "ls"), not of the CLI itself
+        return [self.cli, args[0], *self.key_file_args, *args[1:]]
+
+    def cli_called(self) -> None:
+        """
+        Postpone the inactivity lock after each call to the CLI
+        """
+        if self.inactivity_lock_timeout and self.passphrase_bytes is not None:
+            self.passphrase_expires_at = (
+                time.clock_gettime(LOCK_CLOCK) + self.inactivity_lock_timeout
+            )
+            if self.lock_timer is not None:
+                self.lock_timer.cancel()
+            self.lock_timer = threading.Timer(
+                self.inactivity_lock_timeout, self.lock_timer_fired
+            )
+            self.lock_timer.daemon = True
+            self.lock_timer.start()
+
+    def lock_timer_fired(self) -> None:
+        """
+        Lock the database unless the CLI was called after the timer was started
+
+        A timer that fires during a CLI call waits for state_lock until the
+        call is over, by which time the call has started a new timer.
+        """
+        with self.state_lock:
+            expires_at = self.passphrase_expires_at
+            if threading.current_thread() is self.lock_timer or (
+                expires_at is not None and time.clock_gettime(LOCK_CLOCK) >= expires_at
+            ):
+                self.lock()
 
     def run_cli(self, *args) -> Tuple[str, str, int]:
         """
         Execute the KeePassXC CLI with given args, parse output and handle errors
         Returns (stderr, stdout, return_code)
         """
-        cli_args = [self.cli]
-        
-        # Add key file parameter if available - try as command option
-        if self.key_file_path:
-            cli_args.extend(args[:1])  # Add the command (e.g., "ls")
-            cli_args.extend(["-k", self.key_file_path])  # Add key file parameter
-            cli_args.extend(args[1:])  # Add remaining arguments
-        else:
-            cli_args.extend(args)
-        
-        try:
-            proc = subprocess.run(
-                cli_args,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                input=bytes(self.passphrase, "utf-8"),
-                check=False,
-            )
-        except OSError:
-            raise KeepassxcCliNotFoundError()
+        (stderr, stdout, return_code) = self.run_cli_bytes(*args)
+        return (stderr.decode("utf-8"), stdout.decode("utf-8"), return_code)
 
-        if self.inactivity_lock_timeout:
-            self.passphrase_expires_at = datetime.now() + timedelta(
-                seconds=self.inactivity_lock_timeout
-            )
+    def run_cli_bytes(self, *args) -> Tuple[bytes, bytes, int]:
+        """
+        Same as `run_cli`, but leaves decoding the output to the caller
+        Returns (stderr, stdout, return_code)
+        """
+        # Holding the lock keeps the passphrase from being wiped
+        # while it's being written to the CLI
+        with self.state_lock:
+            if self.passphrase_bytes is None:
+                # Without input the CLI would prompt for the passphrase
+                # on whatever stdin Ulauncher has
+                raise KeepassxcLockedDbError()
+            try:
+                proc = subprocess.run(
+                    self.cli_args(*args),
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    input=self.passphrase_bytes,
+                    check=False,
+                )
+            except OSError:
+                raise KeepassxcCliNotFoundError()
+
+            self.cli_called()
 
-        stderr = proc.stderr.decode("utf-8")
-        stdout = proc.stdout.decode("utf-8")
-        
-        return (stderr, stdout, proc.returncode)
+        return (proc.stderr, proc.stdout, proc.returncode)
@@ -2,6 +2,8 @@
 Functions that deal with rendering Ulauncher result items
 """
 from typing import List, Dict
+from functools import lru_cache
+from itertools import islice
 from ulauncher.api.shared.item.ResultItem import ResultItem
 from ulauncher.api.shared.item.ExtensionResultItem import ExtensionResultItem
 from ulauncher.api.shared.item.ExtensionSmallResultItem import ExtensionSmallResultItem
@@ -14,6 +16,16 @@ from ulauncher.api.shared.action.ActionList import ActionList
 # from ulauncher.api.shared.action.SetUserQueryAction import SetUserQueryAction
 from ulauncher.api.shared.action.CopyToClipboardAction import CopyToClipboardAction
 
+ENTRY_ICON = "images/key.svg"
+
+# Data of the action that activates a search result
+ACTIVATE_ENTRY_TEMPLATE = {
+    "action": "activate_entry",
+    "entry": None,
+    "keyword": None,
+    "prev_query_arg": None,
+}
+
 NO_SEARCH_RESULTS_ITEM = ExtensionResultItem(
     icon="images/not_found.svg",
     name="No matching entries found...",
@@ -22,6 +34,7 @@ NO_SEARCH_RESULTS_ITEM = ExtensionResultItem(
 )
 
 
+@lru_cache(maxsize=32)
 def item_more_results_available(cnt: int) -> ResultItem:
     """
     Item showing how many more results are available
@@ -35,38 +48,86 @@ def item_more_results_available(cnt: int) -> ResultItem:
     )
 
 
+# Entry attributes shown by active_entry, in order:
+# (attribute, label, notification shown after copying, description)
+ACTIVE_ENTRY_ATTRS = [
+    (
+        "Password",
+        "Password",
+        {"action": "show_notification", "summary": "Password copied to the clipboard."},
+        "Copy password to the clipboard",
+    ),
+    (
+        "UserName",
+        "Username",
+        {"action": "show_notification", "summary": "Username copied to the clipboard."},
+        "Copy username to the clipboard",
+    ),
+    (
+        "URL",
+        "URL",
+        {"action": "show_notification", "summary": "URL copied to the clipboard."},
+        "Copy URL to the clipboard",
+    ),
+    (
+        "Notes",
+        "Notes",
+        {"action": "show_notification", "summary": "Notes copied to the clipboard."},
+        "Copy notes to the clipboard",
+    ),
+]
+
+# Actions that never change are built once and reused on every query
+CLI_NOT_FOUND_ACTION = RenderResultListAction(
+    [
+        ExtensionResultItem(
+            icon="images/error.svg",
+            name="Cannot execute keepassxc-cli",
+            # pylint: disable=line-too-long
+            description="Please make sure keepassxc-cli is installed and accessible",  # noqa: E501
+            on_enter=DoNothingAction(),
+        )
+    ]
+)
+
+DB_FILE_NOT_FOUND_ACTION = RenderResultListAction(
+    [
+        ExtensionResultItem(
+            icon="images/error.svg",
+            name="Cannot find the database file",
+            description="Please verify database file path in extension preferences",
+            on_enter=DoNothingAction(),
+        )
+    ]
+)
+
+NO_SEARCH_RESULTS_ACTION = RenderResultListAction([NO_SEARCH_RESULTS_ITEM])
+
+ASK_TO_ENTER_QUERY_ACTION = RenderResultListAction(
+    [
+        ExtensionResultItem(
+            icon="images/keepassxc-search.svg",
+            name="Enter search query...",
+            description="Please enter your search query",
+            on_enter=DoNothingAction(),
+        )
+    ]
+)
+
+
 def cli_not_found_error() -> BaseAction:
     """
     Was not able to execute keepassxc-cli because it was either
     not found or wrong permissions
     """
-    return RenderResultListAction(
-        [
-            ExtensionResultItem(
-                icon="images/error.svg",
-                name="Cannot execute keepassxc-cli",
-                # pylint: disable=line-too-long
-                description="Please make sure keepassxc-cli is installed and accessible",  # noqa: E501
-                on_enter=DoNothingAction(),
-            )
-        ]
-    )
+    return CLI_NOT_FOUND_ACTION
 
 
 def db_file_not_found_error() -> BaseAction:
     """
     Database file specified in preferences could not be found
     """
-    return RenderResultListAction(
-        [
-            ExtensionResultItem(
-                icon="images/error.svg",
-                name="Cannot find the database file",
-                description="Please verify database file path in extension preferences",
-                on_enter=DoNothingAction(),
-            )
-        ]
-    )
+    return DB_FILE_NOT_FOUND_ACTION
 
 
 def keepassxc_cli_error(message: str) -> BaseAction:
@@ -85,9 +146,13 @@ def keepassxc_cli_error(message: str) -> BaseAction:
     )
 
 
+@lru_cache(maxsize=8)
 def ask_to_enter_passphrase(db_path: str, key_file_path: str = None) -> BaseAction:
     """
     Ask user to enter the passphrase to unlock database
+
+    Shown on every query while the database is locked,
+    so the result is cached per database and key file.
     """
     description = db_path
     if key_file_path:
@@ -110,16 +175,7 @@ def ask_to_enter_query() -> BaseAction:
     """
     Ask user to start entering the search query
     """
-    return RenderResultListAction(
-        [
-            ExtensionResultItem(
-                icon="images/keepassxc-search.svg",
-                name="Enter search query...",
-                description="Please enter your search query",
-                on_enter=DoNothingAction(),
-            )
-        ]
-    )
+    return ASK_TO_ENTER_QUERY_ACTION
 
 
 def search_results(
@@ -128,28 +184,23 @@ def search_results(
     """
     Build list of result items `max_items` long
     """
-    items = []
     if not entries:
-        items.append(NO_SEARCH_RESULTS_ITEM)
-    else:
-        for entry in entries[:max_items]:
-            # FUTURE replace with call_object_method
-            action = ExtensionCustomAction(
-                {
-                    "action": "activate_entry",
-                    "entry": entry,
-                    "keyword": keyword,
-                    "prev_query_arg": arg,
-                },
-                keep_app_open=True,
-            )
-            items.append(
-                ExtensionSmallResultItem(
-                    icon="images/key.svg", name=entry, on_enter=action
-                )
-            )
-        if len(entries) > max_items:
-            items.append(item_more_results_available(len(entries) - max_items))
+        return NO_SEARCH_RESULTS_ACTION
+
+    items = []
+    for entry in islice(entries, max_items):
+        # Copying a prebuilt dict is cheaper than building a new one
+        data = ACTIVATE_ENTRY_TEMPLATE.copy()
+        data["entry"] = entry
+        data["keyword"] = keyword
+        data["prev_query_arg"] = arg
+        # FUTURE replace with call_object_method
+        action = ExtensionCustomAction(data, keep_app_open=True)
+        items.append(
+            ExtensionSmallResultItem(icon=ENTRY_ICON, name=entry, on_enter=action)
+        )
+    if len(entries) > max_items:
+        items.append(item_more_results_available(len(entries) - max_items))
     return RenderResultListAction(items)
 
 
@@ -157,27 +208,14 @@ def active_entry(details: Dict[str, str]) -> BaseAction:
     """
     Show details of an entry and allow various items to be copied to the clipboard
     """
-    attrs = [
-        ("Password", "password"),
-        ("UserName", "username"),
-        ("URL", "URL"),
-        ("Notes", "notes"),
-    ]
     items = []
-    for attr, attr_nice in attrs:
+    for attr, label, notification, description in ACTIVE_ENTRY_ATTRS:
         val = details.get(attr, "")
         if val:
             action = ActionList(
                 [
                     # FUTURE replace with call_object_method
-                    ExtensionCustomAction(
-                        {
-                            "action": "show_notification",
-                            "summary": "{} copied to the clipboard.".format(
-                                attr_nice.capitalize()
-                            ),
-                        }
-                    ),
+                    ExtensionCustomAction(notification.copy()),
                     CopyToClipboardAction(val),
                 ]
             )
@@ -186,7 +224,7 @@ def active_entry(details: Dict[str, str]) -> BaseAction:
                 items.append(
                     ExtensionSmallResultItem(
                         icon="images/copy.svg",
-                        name="Copy password to the clipboard",
+                        name=description,
                         on_enter=action,
                     )
                 )
@@ -194,8 +232,8 @@ def active_entry(details: Dict[str, str]) -> BaseAction:
                 items.append(
                     ExtensionResultItem(
                         icon="images/copy.svg",
-                        name="{}: {}".format(attr_nice.capitalize(), val),
-                        description="Copy {} to the clipboard".format(attr_nice),
+                        name=label + ": " + val,
+                        description=description,
                         on_enter=action,
                     )
                 )
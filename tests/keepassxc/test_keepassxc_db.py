@@ -1,3 +1,6 @@
+import os
+import shutil
+import threading
 from time import sleep
 import pytest
 from keepassxc import keepassxc_db as kpdb
@@ -35,9 +38,36 @@ def test_inactivity_lock():
     assert not test_db.is_passphrase_needed()
     # need passphrase again after waiting for more than the timeout
     sleep(TIMEOUT + 0.1)
+    # passphrase is forgotten without having to ask first
+    assert test_db.passphrase_bytes is None
     assert test_db.is_passphrase_needed()
 
 
+def test_inactivity_lock_during_cli_call(monkeypatch):
+    TIMEOUT = 1
+    test_db = kpdb.KeepassxcDatabase()
+    test_db.initialize("tests/data/test.kdbx", TIMEOUT, None)
+    assert test_db.verify_and_set_passphrase("right passphrase")
+
+    def slow_run(args, **kwargs):
+        sleep(0.5)
+        return kpdb.subprocess.CompletedProcess(args, 0, b"", b"")
+
+    # call starts just before the timeout runs out and ends just after
+    sleep(TIMEOUT - 0.2)
+    monkeypatch.setattr(kpdb.subprocess, "run", slow_run)
+    test_db.run_cli("ls", "-q", test_db.path)
+    # the timer that fired during the call must not lock the database
+    sleep(0.1)
+    assert test_db.passphrase_bytes is not None
+    assert not test_db.is_passphrase_needed()
+
+
+def test_run_cli_locked_db(test_db):
+    with pytest.raises(kpdb.KeepassxcLockedDbError):
+        test_db.run_cli("ls", "-q", test_db.path)
+
+
 def test_search_locked_db(test_db):
     with pytest.raises(kpdb.KeepassxcLockedDbError):
         test_db.search("none of this, you see")
@@ -56,6 +86,17 @@ def test_search(test_db):
     assert "onlinesite work" in res
 
 
+def test_search_non_title_field(test_db):
+    test_db.verify_and_set_passphrase("right passphrase")
+    # "username" is the UserName of "onlinesite personal", not part of its title
+    assert "onlinesite personal" in test_db.search("username")
+
+
+def test_search_multiple_terms(test_db):
+    test_db.verify_and_set_passphrase("right passphrase")
+    assert "onlinesite personal" in test_db.search("online personal")
+
+
 def test_get_entry_details_locked_db(test_db):
     with pytest.raises(kpdb.KeepassxcLockedDbError):
         test_db.get_entry_details("onlinesite personal")
@@ -89,6 +130,7 @@ def test_initialize_with_key_file():
     # Test with empty key file path (should work)
     db.initialize("tests/data/test.kdbx", 0, "")
     assert db.key_file_path is None
+    assert db.key_file_args == []
     
     # Test with None key file path (should work)
     db.initialize("tests/data/test.kdbx", 0, None)
@@ -100,3 +142,122 @@ def test_initialize_with_invalid_key_file():
     db = kpdb.KeepassxcDatabase()
     with pytest.raises(kpdb.KeepassxcFileNotFoundError):
         db.initialize("tests/data/test.kdbx", 0, "nonexistent_key_file.key")
+
+
+def test_search_cache(test_db):
+    test_db.verify_and_set_passphrase("right passphrase")
+    res = test_db.search("onlinesite")
+    assert test_db.search_cache["onlinesite"] == res
+
+    # cached results must be served without calling the CLI
+    def no_run_cli_bytes(*args):
+        raise AssertionError(f"CLI called with {args}")
+
+    test_db.run_cli_bytes = no_run_cli_bytes
+    assert test_db.search("onlinesite") == res
+
+
+def test_search_cache_cleared_on_lock(test_db):
+    test_db.verify_and_set_passphrase("right passphrase")
+    test_db.search("onlinesite")
+    test_db.change_inactivity_lock_timeout(10)
+    assert not test_db.search_cache
+
+
+def test_cli_not_found():
+    db = kpdb.KeepassxcDatabase()
+    db.cli = "no-such-keepassxc-cli"
+    with pytest.raises(kpdb.KeepassxcCliNotFoundError):
+        db.initialize("tests/data/test.kdbx", 0, None)
+
+
+def test_cli_found_on_path():
+    db = kpdb.KeepassxcDatabase()
+    assert db.cli == "keepassxc-cli"
+    db.initialize("tests/data/test.kdbx", 0, None)
+    # later calls run the executable that was found, not whatever is on PATH then
+    assert os.path.isabs(db.cli)
+    assert os.path.basename(db.cli) == "keepassxc-cli"
+
+
+def test_parse_search_results():
+    out = b"/onlinesite personal\nWarning: something\n/group/caf\xc3\xa9\n"
+    res = kpdb.parse_search_results(b"", out, 0)
+    assert res == ["onlinesite personal", "group/café"]
+
+
+def test_lock_after_key_file_change(test_db, tmp_path):
+    test_db.verify_and_set_passphrase("right passphrase")
+    # same key file setting as before, stays unlocked
+    test_db.initialize("tests/data/test.kdbx", 0, "")
+    assert not test_db.is_passphrase_needed()
+    key_file = tmp_path / "test.key"
+    key_file.write_bytes(b"key")
+    test_db.initialize("tests/data/test.kdbx", 0, str(key_file))
+    assert test_db.key_file_args == ["-k", str(key_file)]
+    assert test_db.is_passphrase_needed()
+
+
+def test_passphrase_wiped_on_lock(test_db):
+    test_db.verify_and_set_passphrase("right passphrase")
+    passphrase_bytes = test_db.passphrase_bytes
+    test_db.lock()
+    assert test_db.is_passphrase_needed()
+    assert passphrase_bytes == bytes(len("right passphrase"))
+
+
+def test_parse_search_results_error():
+    err = b"No results for that search term.\n"
+    assert kpdb.parse_search_results(err, b"", 1) == []
+    with pytest.raises(kpdb.KeepassxcCliError) as exc_info:
+        kpdb.parse_search_results(b"Invalid \xff credentials\n", b"", 1)
+    assert exc_info.value.message == "Invalid � credentials\n"
+
+
+def test_search_cache_cleared_on_db_change(tmp_path):
+    db_path = tmp_path / "test.kdbx"
+    shutil.copy("tests/data/test.kdbx", db_path)
+    test_db = kpdb.KeepassxcDatabase()
+    test_db.initialize(str(db_path), 0, None)
+    test_db.verify_and_set_passphrase("right passphrase")
+    test_db.search("onlinesite")
+    assert "onlinesite" in test_db.search_cache
+    db_mtime_ns = os.stat(db_path).st_mtime_ns
+    os.utime(db_path, ns=(db_mtime_ns + 10 ** 9, db_mtime_ns + 10 ** 9))
+    assert len(test_db.search("onlinesite personal")) == 1
+    assert "onlinesite" not in test_db.search_cache
+
+
+def test_search_coalesced(test_db):
+    test_db.verify_and_set_passphrase("right passphrase")
+    calls = []
+    run_cli_bytes = test_db.run_cli_bytes
+
+    def slow_run_cli_bytes(*args):
+        calls.append(args)
+        sleep(0.2)
+        return run_cli_bytes(*args)
+
+    test_db.run_cli_bytes = slow_run_cli_bytes
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(test_db.search("onlinesite")))
+        for _ in range(3)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert len(results) == 3
+    assert all(len(res) == 2 for res in results)
+    assert not test_db.inflight_searches
+
+
+def test_search_cache_skips_results_for_old_db(test_db):
+    test_db.verify_and_set_passphrase("right passphrase")
+    db_mtime_ns = test_db.check_db_changed()
+    # another search has noticed that the database file changed
+    test_db.path_mtime_ns = db_mtime_ns + 1
+    test_db.cache_search("onlinesite", ["onlinesite personal"], db_mtime_ns)
+    assert "onlinesite" not in test_db.search_cache